@@ -0,0 +1,40 @@
+-- === SUPPORTING INDEXES FOR THE TALENT MATCHING QUERY ===
+-- Covering indexes for the filters and per-employee joins in talent_matching_query.sql,
+-- so the raw score tables can be read with index(-only) scans instead of sequential scans.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so run this file
+-- statement by statement (e.g. plain `psql -f 2_sql_logic/indexes.sql`, without -1).
+-- === END OF NOTES ===
+
+
+-- Competencies: 2025 medians (STEP 1.A) and the 2025 cleaned scores (STEP 1.B)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_competencies_yearly_year_pillar
+    ON competencies_yearly (year, pillar_code) INCLUDE (employee_id, score);
+
+-- Performance: 2025 rating filter joined per employee (STEP 1.D)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_performance_yearly_emp_year
+    ON performance_yearly (employee_id, year) INCLUDE (rating);
+
+-- Psychometrics: per-employee join for IQ / GTQ / MBTI (STEPS 1.C - 1.D)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_psych_emp
+    ON profiles_psych (employee_id);
+
+-- Strengths: ROW_NUMBER() OVER (PARTITION BY employee_id ORDER BY rank) (STEP 1.E)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_strengths_emp_rank
+    ON strengths (employee_id, "rank") INCLUDE (theme);
+
+-- PAPI: per-scale medians and per-employee pivots (STEP 1.F)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_papi_scores_emp_scale
+    ON papi_scores (employee_id, scale_code) INCLUDE (score);
+
+-- Employees: full name lookups used by the app's ranked list and benchmark selector
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_employees_emp_fullname
+    ON employees (employee_id) INCLUDE (fullname);
+
+-- Refresh planner statistics so the new indexes are picked up
+ANALYZE competencies_yearly;
+ANALYZE performance_yearly;
+ANALYZE profiles_psych;
+ANALYZE strengths;
+ANALYZE papi_scores;
+ANALYZE employees;
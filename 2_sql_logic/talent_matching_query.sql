@@ -247,11 +247,13 @@ papi_cleaned_imputed AS (
     
 -- PHASE 2: BENCHMARKING---
 
--- STEP/CTE 2.A: Select Target Vacancy (SIMULATED)
--- Objective: Manually define benchmark employee IDs (rating=5 Sales Supervisors) simulating a manager's input.
+-- STEP/CTE 2.A: Select Target Vacancy
+-- Objective: Receive the benchmark employee IDs selected by the manager as a bound parameter.
+-- Note: The 'benchmark_ids' parameter is bound by the app as a text[] (e.g. ['EMP100012','EMP100524','EMP100548']),
+--       so PostgreSQL can reuse the same plan for every benchmark selection.
 target_vacancy AS (
     SELECT 
-        ARRAY['EMP100012','EMP100524','EMP100548']::text[] AS selected_talent_ids 
+        CAST(:benchmark_ids AS text[]) AS selected_talent_ids 
 ),
 
 -- STEP/CTE 2.B: Calculate the "Ideal" Benchmark Baseline
@@ -307,18 +309,28 @@ benchmark_baseline AS (
         PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY m.tenure_months) AS baseline_tenure
   
     FROM 
-        (SELECT unnest(ARRAY['EMP100012','EMP100524','EMP100548']::text[]) AS employee_id 
+        (SELECT unnest(selected_talent_ids) AS employee_id 
          FROM target_vacancy) AS benchmark_ids  -- Benchmark Employees
   
     LEFT JOIN main_cleaned_imputed AS m 
         ON benchmark_ids.employee_id = m.employee_id
   
     -- Join strengths (already cleaned & limited to max 5 / employee)
-    LEFT JOIN strengths_cleaned AS s 
+    -- The joined sides below are pre-filtered to the benchmark employees in subqueries,
+    -- so the joins (and the competency aggregation) only touch the benchmark rows.
+    LEFT JOIN (
+        SELECT employee_id, theme
+        FROM strengths_cleaned
+        WHERE employee_id IN (SELECT unnest(selected_talent_ids) FROM target_vacancy)
+    ) AS s 
         ON benchmark_ids.employee_id = s.employee_id
       
     -- Join PAPI Scores
-    LEFT JOIN papi_cleaned_imputed AS p 
+    LEFT JOIN (
+        SELECT employee_id, scale_code, score_imputed
+        FROM papi_cleaned_imputed
+        WHERE employee_id IN (SELECT unnest(selected_talent_ids) FROM target_vacancy)
+    ) AS p 
         ON benchmark_ids.employee_id = p.employee_id
       
     -- Join competencies (aggregated by employee)
@@ -334,6 +346,7 @@ benchmark_baseline AS (
             AVG(score_imputed) FILTER (WHERE pillar_code = 'CSI')             AS avg_csi,
             AVG(score_imputed) FILTER (WHERE pillar_code IN ('CEX', 'GDR'))   AS avg_cex_gdr
         FROM competencies_cleaned_imputed
+        WHERE employee_id IN (SELECT unnest(selected_talent_ids) FROM target_vacancy)
         GROUP BY employee_id
     ) AS c 
         ON benchmark_ids.employee_id = c.employee_id
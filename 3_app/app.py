@@ -1,12 +1,22 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import os
+import asyncio
+import hashlib
+import threading
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import openai
-import plotly.express as px
+from aiolimiter import AsyncLimiter
 import plotly.graph_objects as go
+import plotly.io as pio
+from job_profile_llm import (
+    LLM_BASE_URL, LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_CACHE_EXPIRE_SECONDS, JOB_LEVELS,
+    build_job_profile_messages, job_profile_cache_key, open_llm_disk_cache, request_job_profile
+)
 
 # --- PAGE CONFIGURATION ---
 # Set page layout to wide and define the title shown in the browser tab
@@ -30,15 +40,16 @@ def get_db_engine():
 
     # Create the database connection string
     connection_string = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-    # Return a SQLAlchemy engine object
-    return create_engine(connection_string)
+    # Return a SQLAlchemy engine object that keeps warm, health-checked connections in its pool
+    return create_engine(connection_string, pool_size=5, pool_pre_ping=True, pool_recycle=1800)
 
 # Initialize the database engine
 engine = get_db_engine()
 
 # --- LOAD BASE SQL QUERY ---
-# Cache the base SQL query data to avoid rereading the file on every script rerun
-@st.cache_data
+# Streamlit re-executes this script on every rerun, so a plain module-level read would hit the disk each time;
+# cache it as a resource instead, which hands back the same string without the copy st.cache_data makes
+@st.cache_resource
 def load_base_query():
     """Loads the main talent matching SQL query from an external file."""
     # Construct the path to the SQL query file
@@ -48,66 +59,390 @@ def load_base_query():
         return file.read()
 
 # Store the loaded base SQL query
-base_sql_query = load_base_query()
+BASE_SQL_QUERY = load_base_query()
+
+# Wrap the base query so PostgreSQL does the de-duplication, benchmark exclusion, ranking
+# and TGV aggregation, so only a narrow result leaves the database instead of the
+# employee x TGV x TV fan-out. It returns three kinds of rows, told apart by 'result_kind':
+#   'candidate' -> one ranked row per non-benchmark employee, with its top TGV
+#   'avg_tgv'   -> one row per TGV with its average match rate across all employees
+#   'tgv_rate'  -> one row per employee and TGV with its match rate (for the radar chart)
+ranked_sql_query = f"""
+WITH match_results AS (
+{BASE_SQL_QUERY.strip().rstrip(';')}
+),
+tgv_scores AS (
+    SELECT DISTINCT employee_id, tgv_name, tgv_match_rate
+    FROM match_results
+),
+top_tgv AS (
+    -- Highest-scoring TGV per employee (ties broken by TGV name)
+    SELECT DISTINCT ON (employee_id) employee_id, tgv_name AS top_tgv
+    FROM tgv_scores
+    WHERE tgv_match_rate IS NOT NULL
+    ORDER BY employee_id, tgv_match_rate DESC, tgv_name
+),
+avg_tgv AS (
+    SELECT tgv_name, AVG(tgv_match_rate) AS tgv_match_rate
+    FROM tgv_scores
+    GROUP BY tgv_name
+),
+ranked_candidates AS (
+    SELECT DISTINCT ON (r.employee_id)
+        r.employee_id, e.fullname, r.role, r.grade, r.directorate, r.final_match_rate
+    FROM match_results AS r
+    LEFT JOIN employees AS e ON r.employee_id = e.employee_id
+    WHERE NOT r.is_benchmark
+    ORDER BY r.employee_id
+)
+SELECT
+    'candidate' AS result_kind,
+    c.employee_id, c.fullname, c.role, c.grade, c.directorate, c.final_match_rate,
+    ROW_NUMBER() OVER (ORDER BY c.final_match_rate DESC, c.employee_id) AS rank,
+    COALESCE(t.top_tgv, 'N/A') AS top_tgv,
+    NULL::text AS tgv_name,
+    NULL::numeric AS tgv_match_rate
+FROM ranked_candidates AS c
+LEFT JOIN top_tgv AS t ON c.employee_id = t.employee_id
+UNION ALL
+SELECT
+    'avg_tgv',
+    NULL, NULL, NULL, NULL, NULL, NULL,
+    NULL,
+    NULL,
+    tgv_name,
+    tgv_match_rate
+FROM avg_tgv
+UNION ALL
+SELECT
+    'tgv_rate',
+    employee_id, NULL, NULL, NULL, NULL, NULL,
+    NULL,
+    NULL,
+    tgv_name,
+    tgv_match_rate
+FROM tgv_scores
+ORDER BY result_kind, rank, tgv_match_rate
+"""
+
+# --- SEARCH EMPLOYEES ---
+# Maximum number of matches offered in the benchmark selector per search
+EMPLOYEE_SEARCH_LIMIT = 50
+
+# Cache each search briefly; only the matching page of employees leaves the database
+@st.cache_data(ttl=60, show_spinner=False)
+def search_employees(search_text: str) -> dict:
+    """Finds employees whose name or ID contains the search text, returned as {employee_id: fullname}."""
+    # Escape LIKE wildcards so the text is matched literally
+    escaped_text = search_text.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    query = text("""
+        SELECT employee_id, fullname
+        FROM employees
+        WHERE fullname ILIKE :pattern OR employee_id ILIKE :pattern
+        ORDER BY fullname
+        LIMIT :limit
+    """)
+    # Only a small lookup dict is needed, so skip building a DataFrame
+    with engine.connect() as connection:
+        rows = connection.execute(query, {"pattern": f"%{escaped_text}%", "limit": EMPLOYEE_SEARCH_LIMIT}).fetchall()
+    return {row.employee_id: row.fullname for row in rows}
 
-# --- FETCH EMPLOYEE LIST ---
-# Cache the employee list data
-@st.cache_data
-def get_employee_list():
-    """Fetches employee IDs and full names from the database for selection widgets."""
+@st.cache_data(ttl=60, show_spinner=False)
+def lookup_employee_names(employee_ids: tuple) -> dict:
+    """Fetches the full names of the given employees, returned as {employee_id: fullname}."""
+    query = text("SELECT employee_id, fullname FROM employees WHERE employee_id = ANY(:employee_ids)")
     with engine.connect() as connection:
-        # Query the employees table
-        df = pd.read_sql("SELECT employee_id, fullname FROM employees ORDER BY fullname;", connection)
-    # Create a display column combining name and ID for user-friendliness in widgets
-    df['display'] = df['fullname'] + " (" + df['employee_id'] + ")"
+        rows = connection.execute(query, {"employee_ids": list(employee_ids)}).fetchall()
+    return {row.employee_id: row.fullname for row in rows}
+
+# --- RUN TALENT MATCHING QUERY ---
+# Rows fetched per round trip from the server-side cursor
+MATCH_QUERY_CHUNKSIZE = 10_000
+# Low-cardinality text columns stored as categoricals (integer codes instead of repeated strings)
+CATEGORICAL_COLUMNS = ('result_kind', 'role', 'grade', 'directorate', 'top_tgv', 'tgv_name')
+
+# Cache the query results per benchmark set for an hour (the HR data behind them changes rarely)
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_match_query(benchmark_ids: tuple[str, ...]) -> pd.DataFrame:
+    """Runs the talent matching SQL query for the given (sorted) tuple of benchmark employee IDs."""
+    # Bind the IDs to the ':benchmark_ids' text[] parameter of the base query and stream the rows
+    # through a server-side cursor in chunks, so they are never all materialized as tuples at once
+    with engine.connect().execution_options(stream_results=True) as connection:
+        chunks = pd.read_sql(
+            text(ranked_sql_query), connection,
+            params={"benchmark_ids": list(benchmark_ids)},
+            chunksize=MATCH_QUERY_CHUNKSIZE
+        )
+        df = pd.concat(chunks, ignore_index=True)
+    # Convert to Arrow-backed dtypes once all chunks are in (much lighter than object-dtype strings);
+    # converting per chunk would give all-NULL chunk columns a null type that doesn't concatenate
+    df = df.convert_dtypes(dtype_backend="pyarrow")
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
     return df
 
+# --- SESSION STATE STORAGE ---
+# Keep the results in session state as compact Arrow IPC bytes rather than a live DataFrame:
+# Streamlit keeps session state around until the server restarts, even after the tab is closed
+def results_to_ipc(df: pd.DataFrame) -> bytes:
+    """Serializes a DataFrame into Arrow IPC stream bytes."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def results_from_ipc(ipc_bytes: bytes) -> pd.DataFrame:
+    """Decodes Arrow IPC stream bytes back into an Arrow-backed DataFrame."""
+    # Categoricals travel as Arrow dictionary columns; map those back to pandas categoricals
+    return pa.ipc.open_stream(ipc_bytes).read_all().to_pandas(
+        types_mapper=lambda arrow_type: None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+    )
+
+# Standard TGVs, in the order they appear on the radar chart axes
+TGV_ORDER = [
+    'Competency',
+    'Psychometric (Cognitive)',
+    'Psychometric (Personality)',
+    'Behavioral (Strengths)',
+    'Contextual (Background)',
+]
+
+# Derive the display frames once per Generate click, so widget reruns only decode them
+def build_display_frames(df_sql_results: pd.DataFrame):
+    """Splits the SQL output into the ranked candidate list, the TGV averages and the per-employee TGV rates."""
+    # One row per candidate, already ranked, sorted and tagged with its top TGV in SQL (benchmarks excluded)
+    df_candidates = df_sql_results[df_sql_results['result_kind'] == 'candidate']
+    df_ranked_candidates = (
+        df_candidates[['rank', 'employee_id', 'fullname', 'role', 'grade', 'directorate', 'top_tgv', 'final_match_rate']]
+        .rename(columns={'rank': 'Rank'})
+        .reset_index(drop=True)
+    )
+    # Rank is nullable in the SQL output because the TGV average rows leave it NULL
+    df_ranked_candidates['Rank'] = df_ranked_candidates['Rank'].astype(int)
+    # Already sorted ascending in SQL
+    avg_tgv = df_sql_results.loc[df_sql_results['result_kind'] == 'avg_tgv', ['tgv_name', 'tgv_match_rate']].reset_index(drop=True)
+    # One row per employee (benchmarks included) and one float32 column per TGV in TGV_ORDER (missing TGVs as 0)
+    tgv_rates = (
+        df_sql_results.loc[df_sql_results['result_kind'] == 'tgv_rate', ['employee_id', 'tgv_name', 'tgv_match_rate']]
+        .astype({'employee_id': str, 'tgv_name': str, 'tgv_match_rate': 'float64'})
+        .pivot_table(index='employee_id', columns='tgv_name', values='tgv_match_rate', aggfunc='mean')
+        .reindex(columns=TGV_ORDER).fillna(0.0).astype(np.float32)
+        .reset_index()
+    )
+    return df_ranked_candidates, avg_tgv, tgv_rates
+
+# --- TGV RATES FOR THE RADAR CHART ---
+def tgv_radar_rows(tgv_rates: pd.DataFrame, benchmark_ids: tuple[str, ...], candidate_id: str):
+    """Returns the benchmark-average and candidate TGV match rates as float32 arrays in TGV_ORDER (missing as 0)."""
+    # Slice the per-employee rates fetched with the ranked list, so picking a candidate costs no query
+    employee_ids = tgv_rates['employee_id'].to_numpy(dtype=object)
+    rates = tgv_rates[TGV_ORDER].to_numpy(dtype=np.float32)
+    bench_mask = np.isin(employee_ids, benchmark_ids)
+    cand_mask = employee_ids == candidate_id
+    bench_row = rates[bench_mask].mean(axis=0) if bench_mask.any() else np.zeros(len(TGV_ORDER), dtype=np.float32)
+    cand_row = rates[cand_mask][0] if cand_mask.any() else np.zeros(len(TGV_ORDER), dtype=np.float32)
+    return bench_row, cand_row
+
+# --- CHART BUILDERS ---
+# Plotly figure construction is expensive, so each chart is built once per input data
+# and cached as its JSON spec; the view rebuilds the figure with pio.from_json
+
+# The histogram is keyed only on a digest of the values (the underscore skips hashing the array itself)
+@st.cache_data(show_spinner=False)
+def match_rate_histogram_json(values_hash: bytes, _values: np.ndarray) -> str:
+    """Builds the final match rate histogram and returns its JSON spec."""
+    # Bin in numpy (20 bins of 5% over 0-100) so the chart only carries the bin counts
+    counts, edges = np.histogram(_values[~np.isnan(_values)], bins=np.linspace(0, 100, 21))
+    fig_hist = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=4.5))
+    fig_hist.update_layout(xaxis_title="Final Match Rate (%)", yaxis_title="Number of Candidates", xaxis_range=[0,100])
+    return fig_hist.to_json()
+
+@st.cache_data(show_spinner=False)
+def tgv_bar_chart_json(avg_tgv: pd.DataFrame) -> str:
+    """Builds the horizontal bar chart of average TGV match rates and returns its JSON spec."""
+    rates = avg_tgv['tgv_match_rate'].to_numpy(dtype=np.float64, na_value=np.nan)
+    fig_tgv = go.Figure(go.Bar(
+        x=rates,
+        y=avg_tgv['tgv_name'].tolist(),
+        orientation='h',
+        text=[f"{rate:.1f}" for rate in rates] # Display values on bars
+    ))
+    fig_tgv.update_layout(xaxis_title="Average Match Rate (%)", yaxis_title="Talent Group Variable",
+                          xaxis_range=[0,100]) # Ensure x-axis goes up to 100
+    return fig_tgv.to_json()
+
+@st.cache_data(show_spinner=False)
+def radar_chart_json(candidate_id, tgv_names: tuple, bench_scores: tuple, cand_scores: tuple) -> str:
+    """Builds the benchmark vs. candidate TGV radar chart and returns its JSON spec."""
+    fig_radar = go.Figure()
+    # Add trace for Benchmark Average scores
+    fig_radar.add_trace(go.Scatterpolar(
+        r=bench_scores,                 # Radial values (scores)
+        theta=tgv_names,                # Angular values (TGV names)
+        fill='toself',                  # Fill the area under the line
+        name='Benchmark Average',       # Legend name
+        line_color='lightcoral'         # Line color
+    ))
+    # Add trace for the Selected Candidate's scores
+    fig_radar.add_trace(go.Scatterpolar(
+        r=cand_scores,                  # Radial values (scores)
+        theta=tgv_names,                # Angular values (TGV names)
+        fill='toself',                  # Fill the area under the line
+        name=f'Candidate ({candidate_id})', # Legend name
+        line_color='skyblue'            # Line color
+    ))
+    # Configure layout properties for the radar chart
+    fig_radar.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0, 100])), # Set radial axis range 0-100
+        showlegend=True, # Display the legend
+        title=f"TGV Comparison: Benchmark Average vs {candidate_id}" # Chart title
+    )
+    return fig_radar.to_json()
+
+# --- SHARED LLM EVENT LOOP ---
+# Cache as a resource so all sessions (each running in its own script thread) share one loop and one set of limits
+# on OpenRouter traffic
+@st.cache_resource
+def get_llm_runtime():
+    """Starts a background event loop for LLM calls, with a shared semaphore and rate limiter bound to it."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+    # Both primitives are only ever awaited on this loop
+    llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    llm_limiter = AsyncLimiter(LLM_REQUESTS_PER_MINUTE, 60)
+    return loop, llm_semaphore, llm_limiter
+
+# One client (and so one pooled, kept-alive HTTP connection set) per API key for the whole process;
+# it is only ever used from the shared LLM loop above
+@st.cache_resource
+def get_llm_client(api_key):
+    """Creates the async OpenAI client configured for OpenRouter (retries are handled by tenacity)."""
+    return openai.AsyncOpenAI(base_url=LLM_BASE_URL, api_key=api_key, max_retries=0)
+
+# --- PERSISTENT LLM CACHE ---
+# Cache the disk cache handle as a resource so it is opened once per process
+@st.cache_resource
+def get_llm_disk_cache():
+    """Opens the on-disk cache of generated job profiles (shared with prebake_profiles.py)."""
+    return open_llm_disk_cache()
+
 # --- GENERATE AI JOB PROFILE ---
-# Cache the generated job profile based on inputs
+# Cache the generated job profile based on inputs (process-local layer on top of the disk cache);
+# st.cache_data doesn't cache exceptions, so a failed generation is retried on the next call
 @st.cache_data
 def generate_job_profile(role_name, job_level, role_purpose):
-    """Generates a job profile using an AI model via OpenRouter API."""
+    """Generates a job profile using an AI model via OpenRouter API, awaiting the request on the shared LLM loop."""
     # Retrieve the API key from environment variables
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         return "Error: Missing OpenRouter API key. Please set it in your .env file."
 
-    # Define the prompt for the AI model
-    prompt = f"""
-    Generate a concise job profile for the following role:
-    Role: {role_name}
-    Level: {job_level}
-    Purpose: {role_purpose}
-
-    Structure the output using markdown with these sections:
-    ## Job Requirements
-    - Provide 5 to 7 key requirements as bullet points.
-    ## Job Description
-    - Write a brief paragraph summarizing the role's responsibilities.
-    ## Key Competencies
-    - List 5 essential competencies as bullet points.
-    """
-    try:
-        # Initialize the OpenAI client configured for OpenRouter
-        client = openai.OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
-        # Make the API call to generate the job profile
-        response = client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free", # Using a capable free model
-            messages=[
-                {"role": "system", "content": "You are an expert HR assistant specializing in job profile creation."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=400, # Limit the response length
-            temperature=0.6 # Control the creativity of the response
+    # Define the prompt for the AI model (shared with the prebake script)
+    messages = build_job_profile_messages(role_name, job_level, role_purpose)
+    # Reuse a profile generated earlier (possibly before a restart) for the same inputs; the blocking
+    # disk reads and writes stay on this thread so they never stall other sessions' requests on the LLM loop
+    disk_cache = get_llm_disk_cache()
+    cache_key = job_profile_cache_key(role_name, job_level, role_purpose)
+    cached_profile = disk_cache.get(cache_key)
+    if cached_profile is not None:
+        return cached_profile
+
+    # Resolve the shared loop, limits and OpenRouter client here, where the script context is available;
+    # only the request itself runs on the LLM loop
+    loop, llm_semaphore, llm_limiter = get_llm_runtime()
+    client = get_llm_client(api_key)
+    # Make the API call to generate the job profile; errors propagate once retries run out
+    future = asyncio.run_coroutine_threadsafe(request_job_profile(client, llm_semaphore, llm_limiter, messages), loop)
+    response = future.result()
+    # Extract the generated text and persist it (only successful responses are stored)
+    profile = response.choices[0].message.content.strip()
+    disk_cache.set(cache_key, profile, expire=LLM_CACHE_EXPIRE_SECONDS)
+    return profile
+
+# --- RUN SQL AND AI CONCURRENTLY ---
+def run_with_script_ctx(ctx, func, *args):
+    """Runs func on the current worker thread with the session's ScriptRunContext attached."""
+    # Without it, Streamlit's cached functions log "missing ScriptRunContext" and can't show their spinners
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return func(*args)
+
+async def run_match_and_profile(benchmark_ids, role_name, job_level, role_purpose):
+    """Runs the matching query and the job profile generation concurrently (they are independent)."""
+    # Both cached functions are blocking, so each runs in a worker thread and their latencies overlap;
+    # asyncio.run shuts its worker threads down afterwards, so the attached context doesn't outlive this call
+    ctx = get_script_run_ctx()
+    df_sql_results, ai_profile = await asyncio.gather(
+        asyncio.to_thread(run_with_script_ctx, ctx, run_match_query, benchmark_ids),
+        asyncio.to_thread(run_with_script_ctx, ctx, generate_job_profile, role_name, job_level, role_purpose),
+        return_exceptions=True
+    )
+    # A failed query fails the whole run; a failed profile is handed back for the results block to show
+    if isinstance(df_sql_results, Exception):
+        raise df_sql_results
+    return df_sql_results, ai_profile
+
+# --- BENCHMARK VS. CANDIDATE COMPARISON ---
+# Run as a fragment: changing the selected candidate only reruns this block,
+# not the job profile, ranked table and dashboard charts above it
+@st.fragment
+def comparison_fragment(df_ranked_candidates, tgv_rates, benchmark_ids):
+    """Renders the candidate selector, the TGV radar chart and the summary insights."""
+    # Check if there are candidates to select from for comparison
+    if not df_ranked_candidates.empty:
+        # Create options for the candidate selection dropdown (ID - Fullname)
+        candidate_options = df_ranked_candidates['employee_id'] + " - " + df_ranked_candidates['fullname']
+        # Selectbox widget to choose a candidate
+        selected_candidate_display = st.selectbox("Select Candidate:", options=candidate_options)
+        # Extract the employee ID from the selected display string
+        selected_candidate_id = selected_candidate_display.split(" - ")[0]
+
+        # Benchmark-average and candidate TGV rates (one value per TGV, in TGV_ORDER)
+        bench_row, cand_row = tgv_radar_rows(tgv_rates, benchmark_ids, selected_candidate_id)
+
+        # --- Create Radar Chart (cached JSON spec per candidate and scores) ---
+        fig_radar_json = radar_chart_json(
+            selected_candidate_id,
+            tuple(TGV_ORDER),
+            tuple(bench_row.tolist()),
+            tuple(cand_row.tolist())
         )
-        # Extract and return the generated text
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        # Handle potential API errors gracefully
-        st.error(f"Error generating AI profile: {e}")
-        return "Failed to generate AI profile."
+        # Display the radar chart in Streamlit
+        st.plotly_chart(pio.from_json(fig_radar_json), use_container_width=True)
+
+        # --- Display Summary Insights: Strongest Area and Largest Gap ---
+        st.markdown("**Summary Insights:**")
+        # Calculate the difference between candidate and benchmark average scores for each TGV
+        diff = cand_row - bench_row
+        # Check if there are valid differences to analyze
+        if not np.isnan(diff).all():
+            # Find the position (and thus TGV name) of the maximum difference (candidate's strength)
+            i_max = int(np.nanargmax(diff))
+            # Find the position (and thus TGV name) of the minimum difference (candidate's largest gap)
+            i_min = int(np.nanargmin(diff))
+            # Display the strongest TGV using st.success for positive emphasis
+            st.success(
+                f"**Candidate's Strongest Area (vs Benchmark):** {TGV_ORDER[i_max]} "
+                f"({cand_row[i_max]:.1f}% vs {bench_row[i_max]:.1f}%)"
+            )
+            # Display the largest gap using st.warning for cautionary emphasis
+            st.warning(
+                f"**Candidate's Largest Gap (vs Benchmark):** {TGV_ORDER[i_min]} "
+                f"({cand_row[i_min]:.1f}% vs {bench_row[i_min]:.1f}%)"
+            )
+        else:
+            # Handle cases where differences couldn't be calculated (e.g., all NaNs)
+            st.info("Could not determine detailed comparison insights.")
+
+    else:
+        # Handle case where there are no candidates (df_ranked_candidates is empty)
+        st.info("No candidates found matching the criteria for comparison after excluding benchmarks.")
 
 # --- MAIN STREAMLIT UI ---
+# Benchmark employees pre-selected when the app loads
+DEFAULT_BENCHMARK_IDS = ('EMP100012', 'EMP100524', 'EMP100548')
+
 st.title("Talent Match Intelligence System 🧠✨")
 st.markdown("Use the sidebar to input vacancy details and select benchmark employees to generate ranked matches.")
 
@@ -116,21 +451,27 @@ with st.sidebar:
     st.header("Vacancy & Benchmark Settings")
     # Input fields for vacancy details
     role_name_input = st.text_input("Role Name", "Data Analyst") # Default role name
-    job_level_input = st.selectbox("Job Level", ["Staff", "Supervisor", "Manager", "Senior Manager"], index=1) # Default to Supervisor
+    job_level_input = st.selectbox("Job Level", JOB_LEVELS, index=1) # Default to Supervisor
     role_purpose_input = st.text_area("Role Purpose", "Analyze complex datasets to extract meaningful insights and support data-driven decision-making across the organization.", height=100)
 
-    # Fetch employee list for the multiselect widget
-    employee_list_df = get_employee_list()
-    # Multiselect widget for choosing benchmark employees
-    selected_benchmarks = st.multiselect(
+    # Start from the predefined benchmark IDs (those that exist) and remember the selection across searches
+    if 'selected_benchmark_ids' not in st.session_state:
+        default_names = lookup_employee_names(DEFAULT_BENCHMARK_IDS)
+        st.session_state.selected_benchmark_ids = [eid for eid in DEFAULT_BENCHMARK_IDS if eid in default_names]
+    # Search the employees table server-side instead of loading every employee into the widget
+    search_text = st.text_input("Search benchmark employees (name or ID):")
+    search_matches = search_employees(search_text)
+    # Names for both the current selection and the search matches
+    employee_names = {**lookup_employee_names(tuple(st.session_state.selected_benchmark_ids)), **search_matches}
+    # Multiselect widget for choosing benchmark employees (keeps the current selection among the options);
+    # the key ties the widget to the seeded session state value, so its identity stays stable as the options change
+    selected_benchmark_ids = st.multiselect(
         "Select up to 3 benchmark employees:",
-        options=employee_list_df['display'], # Show "Fullname (ID)"
+        options=list(dict.fromkeys(st.session_state.selected_benchmark_ids + list(search_matches))),
+        format_func=lambda eid: f"{employee_names.get(eid, eid)} ({eid})", # Show "Fullname (ID)"
         max_selections=3,
-        # Set default selections based on predefined IDs
-        default=[emp['display'] for _, emp in employee_list_df.iterrows() if emp['employee_id'] in ['EMP100012', 'EMP100524', 'EMP100548']][:3]
+        key="selected_benchmark_ids"
     )
-    # Extract only the employee IDs from the selected display strings
-    selected_benchmark_ids = [display_str.split('(')[-1].replace(')', '') for display_str in selected_benchmarks]
 
     # Button to trigger the query execution and profile generation
     generate_button = st.button("✨ Generate Profile & Matches")
@@ -142,94 +483,55 @@ if generate_button:
     if not selected_benchmark_ids:
         st.sidebar.error("Please select at least one benchmark employee.")
     else:
-        # Format the selected employee IDs into a PostgreSQL array string for the SQL query
-        sql_array_string = "ARRAY[" + ",".join([f"'{eid}'" for eid in selected_benchmark_ids]) + "]::text[]"
-        # Replace the placeholder array in the base SQL query with the selected IDs
-        parameterized_query = base_sql_query.replace("ARRAY['EMP100012','EMP100524','EMP100548']::text[]", sql_array_string)
-
         # Show a spinner while the query is running
         with st.spinner("Analyzing talent data... ⏳"):
             try:
-                # Execute the parameterized SQL query
-                with engine.connect() as connection:
-                    df_sql_results = pd.read_sql(text(parameterized_query), connection)
-                # Store the results and inputs in Streamlit's session state
-                st.session_state.sql_results = df_sql_results
+                # Execute the SQL query (sorted so the same benchmark set always hits the same cache entry)
+                # while the AI job profile is generated in parallel; the profile is picked up from cache below
+                df_sql_results, ai_profile = asyncio.run(run_match_and_profile(
+                    tuple(sorted(selected_benchmark_ids)), role_name_input, job_level_input, role_purpose_input
+                ))
+                # Keep a failed profile's error for the results block (cleared by the next successful Generate)
+                st.session_state.ai_profile_error = str(ai_profile) if isinstance(ai_profile, Exception) else None
+                # Store the display-ready results and inputs in Streamlit's session state
+                df_ranked_candidates, avg_tgv, tgv_rates = build_display_frames(df_sql_results)
+                st.session_state.ranked_candidates_ipc = results_to_ipc(df_ranked_candidates)
+                st.session_state.avg_tgv_ipc = results_to_ipc(avg_tgv)
+                st.session_state.tgv_rates_ipc = results_to_ipc(tgv_rates)
                 st.session_state.inputs = {'role': role_name_input, 'level': job_level_input, 'purpose': role_purpose_input, 'benchmarks': selected_benchmark_ids}
                 st.success("Analysis complete! Results below. 👇")
             except Exception as e:
                 # Display database errors clearly
                 st.error(f"Database query failed: {e}")
                 # Clear potentially stale results if query fails
-                if 'sql_results' in st.session_state: del st.session_state.sql_results
+                if 'ranked_candidates_ipc' in st.session_state: del st.session_state.ranked_candidates_ipc
 
 # --- DISPLAY RESULTS ---
 # This block runs if results are available in the session state
-if 'sql_results' in st.session_state:
-    # Retrieve the DataFrame and inputs from session state
-    df = st.session_state.sql_results
+if 'ranked_candidates_ipc' in st.session_state:
+    # Retrieve the ranked candidates, TGV averages and inputs from session state
+    df_ranked_candidates = results_from_ipc(st.session_state.ranked_candidates_ipc)
+    avg_tgv = results_from_ipc(st.session_state.avg_tgv_ipc)
+    tgv_rates = results_from_ipc(st.session_state.tgv_rates_ipc)
     inputs = st.session_state.inputs
-    # Ensure employee_list_df is available (it should be due to caching)
-    employee_list_df = get_employee_list()
 
     # Wrap the main result processing in a try-except block for robustness
     try:
         # --- Display AI Generated Job Profile ---
         st.write("---") # Visual separator
         st.subheader("🤖 Job Profile")
-        # Generate and display the profile (uses cached result if inputs haven't changed)
-        ai_profile = generate_job_profile(inputs['role'], inputs['level'], inputs['purpose'])
-        st.markdown(ai_profile)
+        if st.session_state.get('ai_profile_error'):
+            # Generation failed on the last Generate click; clicking it again retries
+            st.error(f"Error generating AI profile: {st.session_state.ai_profile_error}")
+        else:
+            # Display the profile (uses cached result if inputs haven't changed)
+            ai_profile = generate_job_profile(inputs['role'], inputs['level'], inputs['purpose'])
+            st.markdown(ai_profile)
 
         # --- Display Ranked Talent List ---
         st.write("---") # Visual separator
         st.subheader("📊 Ranked Talent List")
 
-        # --- Calculate Top TGV (Domain) for each employee ---
-        df_top_tgv = pd.DataFrame() # Initialize an empty DataFrame
-        # Check if necessary columns exist in the SQL output
-        if not df.empty and 'tgv_match_rate' in df.columns and 'tgv_name' in df.columns and 'employee_id' in df.columns:
-            # First, get the unique TGV rate per employee/TGV combination, as TGV rate repeats for each TV row
-            df_unique_tgv = df[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates()
-            # Then, find the index of the row with the maximum tgv_match_rate for each employee_id
-            # Note: idxmax() finds the *first* occurrence in case of ties
-            idx = df_unique_tgv.loc[df_unique_tgv.groupby('employee_id')['tgv_match_rate'].idxmax()]
-            # Select only employee_id and the corresponding tgv_name (the top TGV)
-            df_top_tgv = idx[['employee_id', 'tgv_name']].copy()
-            # Rename the 'tgv_name' column to 'top_tgv' for clarity before merging
-            df_top_tgv.rename(columns={'tgv_name': 'top_tgv'}, inplace=True)
-        else:
-            # If data is missing, create an empty DataFrame with the expected columns
-            st.warning("Could not calculate Top TGV due to missing data in SQL results.")
-            df_top_tgv = pd.DataFrame(columns=['employee_id', 'top_tgv'])
-        # ----------------------------------------------------
-
-        # Create the base ranked DataFrame (one row per employee)
-        # Select necessary columns and remove duplicate employee rows
-        df_ranked = df[['employee_id', 'role', 'grade', 'directorate', 'final_match_rate', 'is_benchmark']].drop_duplicates('employee_id').copy()
-
-        # Merge with the employee list DataFrame to add the 'fullname' column
-        df_ranked = pd.merge(df_ranked, employee_list_df[['employee_id', 'fullname']], on='employee_id', how='left')
-
-        # --- Merge the calculated Top TGV information ---
-        if not df_top_tgv.empty:
-            df_ranked = pd.merge(df_ranked, df_top_tgv, on='employee_id', how='left')
-            # Fill any potential missing values with 'N/A' (e.g., if an employee had no TGV scores)
-            df_ranked['top_tgv'] = df_ranked['top_tgv'].fillna('N/A')
-        else:
-            # If df_top_tgv couldn't be calculated, add an 'N/A' column to df_ranked
-             df_ranked['top_tgv'] = 'N/A'
-        # -------------------------------------------------
-
-        # Filter out benchmark employees for the final ranked list display
-        df_ranked_candidates = df_ranked[df_ranked['is_benchmark'] == False].copy()
-
-        # Sort candidates by final match rate in descending order
-        df_ranked_candidates = df_ranked_candidates.sort_values('final_match_rate', ascending=False).reset_index(drop=True)
-
-        # Add a 'Rank' column based on the sorted order
-        df_ranked_candidates.insert(0, 'Rank', range(1, len(df_ranked_candidates) + 1))
-
         # Display the ranked list using Streamlit's DataFrame component
         st.dataframe(
             # Select and order columns for display, including the new 'top_tgv'
@@ -259,29 +561,20 @@ if 'sql_results' in st.session_state:
         with col1:
             st.markdown("**Final Match Rate Distribution (Candidates)**")
             if not df_ranked_candidates.empty:
-                fig_hist = px.histogram(df_ranked_candidates, x="final_match_rate", nbins=20,
-                                        labels={'final_match_rate': 'Final Match Rate (%)'})
-                fig_hist.update_layout(yaxis_title="Number of Candidates", bargap=0.1, xaxis_range=[0,100])
-                st.plotly_chart(fig_hist, use_container_width=True)
+                # Key the cached figure on a digest of the raw match rate bytes
+                match_rates = df_ranked_candidates['final_match_rate'].to_numpy(dtype=np.float64, na_value=np.nan)
+                match_rates_hash = hashlib.blake2b(match_rates.tobytes()).digest()
+                fig_hist_json = match_rate_histogram_json(match_rates_hash, match_rates)
+                st.plotly_chart(pio.from_json(fig_hist_json), use_container_width=True)
             else:
                 st.warning("No candidate data available for histogram.")
 
         # Bar Chart of Average TGV Match Rate (across ALL employees in the initial SQL result)
         with col2:
             st.markdown("**Average Match Rate per TGV (All Employees)**")
-            if not df.empty and 'tgv_match_rate' in df.columns:
-                # Drop duplicates first because tgv_match_rate is repeated for each TV within a TGV per employee
-                df_tgv_unique = df[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates()
-                # Calculate the average match rate for each TGV
-                avg_tgv = df_tgv_unique.groupby('tgv_name')['tgv_match_rate'].mean().reset_index()
-                #Sort values
-                avg_tgv = avg_tgv.sort_values('tgv_match_rate', ascending=True) 
-                # Create the horizontal bar chart
-                fig_tgv = px.bar(avg_tgv, x='tgv_match_rate', y='tgv_name', orientation='h',
-                                 text_auto='.1f', # Display values on bars
-                                 labels={'tgv_match_rate': 'Average Match Rate (%)', 'tgv_name': 'Talent Group Variable'})
-                fig_tgv.update_layout(xaxis_range=[0,100]) # Ensure x-axis goes up to 100
-                st.plotly_chart(fig_tgv, use_container_width=True)
+            if not avg_tgv.empty:
+                # Create the horizontal bar chart (cached JSON spec)
+                st.plotly_chart(pio.from_json(tgv_bar_chart_json(avg_tgv)), use_container_width=True)
             else:
                 st.warning("No TGV data available for bar chart.")
 
@@ -289,92 +582,8 @@ if 'sql_results' in st.session_state:
         st.write("---") # Visual separator
         st.subheader("🔍 Benchmark vs. Candidate Comparison")
 
-        # Check if there are candidates to select from for comparison
-        if not df_ranked_candidates.empty:
-            # Create options for the candidate selection dropdown (ID - Fullname)
-            candidate_options = df_ranked_candidates['employee_id'] + " - " + df_ranked_candidates['fullname']
-            # Selectbox widget to choose a candidate
-            selected_candidate_display = st.selectbox("Select Candidate:", options=candidate_options)
-            # Extract the employee ID from the selected display string
-            selected_candidate_id = selected_candidate_display.split(" - ")[0]
-
-            # Filter the main DataFrame 'df' for benchmark employees and the selected candidate
-            benchmark_data = df[df['is_benchmark']]
-            candidate_data = df[df['employee_id'] == selected_candidate_id]
-
-            # Calculate the average TGV match rate for benchmarks and the selected candidate
-            # Important: Drop duplicates first as TGV rate is repeated per TV row within the same TGV/employee
-            bench_tgv_avg = benchmark_data[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates().groupby('tgv_name')['tgv_match_rate'].mean()
-            cand_tgv_avg = candidate_data[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates().groupby('tgv_name')['tgv_match_rate'].mean()
-
-            # --- Ensure all standard TGVs are present for the radar chart axes ---
-            default_tgvs = [
-                'Competency',
-                'Psychometric (Cognitive)',
-                'Psychometric (Personality)',
-                'Behavioral (Strengths)',
-                'Contextual (Background)',
-            ]
-            # Create a base DataFrame with standard TGV names
-            radar_df = pd.DataFrame({'tgv_name': default_tgvs})
-            # Map the calculated average scores onto this base, filling missing TGVs with 0
-            radar_df['Benchmark Avg'] = radar_df['tgv_name'].map(bench_tgv_avg).fillna(0)
-            radar_df['Candidate'] = radar_df['tgv_name'].map(cand_tgv_avg).fillna(0)
-
-            # --- Create Radar Chart using Plotly Graph Objects ---
-            fig_radar = go.Figure()
-            # Add trace for Benchmark Average scores
-            fig_radar.add_trace(go.Scatterpolar(
-                r=radar_df['Benchmark Avg'],      # Radial values (scores)
-                theta=radar_df['tgv_name'],     # Angular values (TGV names)
-                fill='toself',                  # Fill the area under the line
-                name='Benchmark Average',       # Legend name
-                line_color='lightcoral'         # Line color
-            ))
-            # Add trace for the Selected Candidate's scores
-            fig_radar.add_trace(go.Scatterpolar(
-                r=radar_df['Candidate'],        # Radial values (scores)
-                theta=radar_df['tgv_name'],     # Angular values (TGV names)
-                fill='toself',                  # Fill the area under the line
-                name=f'Candidate ({selected_candidate_id})', # Legend name
-                line_color='skyblue'            # Line color
-            ))
-            # Configure layout properties for the radar chart
-            fig_radar.update_layout(
-                polar=dict(radialaxis=dict(visible=True, range=[0, 100])), # Set radial axis range 0-100
-                showlegend=True, # Display the legend
-                title=f"TGV Comparison: Benchmark Average vs {selected_candidate_id}" # Chart title
-            )
-            # Display the radar chart in Streamlit
-            st.plotly_chart(fig_radar, use_container_width=True)
-
-            # --- Display Summary Insights: Strongest Area and Largest Gap ---
-            st.markdown("**Summary Insights:**")
-            # Calculate the difference between candidate and benchmark average scores for each TGV
-            diffs = radar_df['Candidate'] - radar_df['Benchmark Avg']
-            # Check if there are valid differences to analyze
-            if diffs.notna().any():
-                # Find the index (and thus TGV name) of the maximum difference (candidate's strength)
-                idx_max_diff = diffs.idxmax()
-                # Find the index (and thus TGV name) of the minimum difference (candidate's largest gap)
-                idx_min_diff = diffs.idxmin()
-                # Display the strongest TGV using st.success for positive emphasis
-                st.success(
-                    f"**Candidate's Strongest Area (vs Benchmark):** {radar_df.loc[idx_max_diff, 'tgv_name']} "
-                    f"({radar_df.loc[idx_max_diff, 'Candidate']:.1f}% vs {radar_df.loc[idx_max_diff, 'Benchmark Avg']:.1f}%)"
-                )
-                # Display the largest gap using st.warning for cautionary emphasis
-                st.warning(
-                    f"**Candidate's Largest Gap (vs Benchmark):** {radar_df.loc[idx_min_diff, 'tgv_name']} "
-                    f"({radar_df.loc[idx_min_diff, 'Candidate']:.1f}% vs {radar_df.loc[idx_min_diff, 'Benchmark Avg']:.1f}%)"
-                )
-            else:
-                # Handle cases where differences couldn't be calculated (e.g., all NaNs)
-                st.info("Could not determine detailed comparison insights.")
-
-        else:
-            # Handle case where there are no candidates (df_ranked_candidates is empty)
-            st.info("No candidates found matching the criteria for comparison after excluding benchmarks.")
+        # Render the comparison in a fragment so picking another candidate only reruns this section
+        comparison_fragment(df_ranked_candidates, tgv_rates, tuple(sorted(inputs['benchmarks'])))
 
     # General error catching for the results display section
     except Exception as e:
@@ -2,11 +2,13 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
-import openai
-import plotly.express as px
-import plotly.graph_objects as go
+# openai and plotly are imported lazily where they are used, so the first page load doesn't pay for them
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(layout="wide", page_title="Talent Match App")
@@ -30,7 +32,8 @@ def get_db_engine():
 engine = get_db_engine()
 
 # --- LOAD BASE SQL QUERY ---
-@st.cache_data
+# Both queries are argument-free resources, so reruns get the same strings back without hashing or copying them
+@st.cache_resource
 def load_base_query():
     """Loads the main talent matching SQL query from an external file."""
     sql_file_path = os.path.join(os.path.dirname(__file__), '..', '2_sql_logic', 'talent_matching_query.sql')
@@ -39,6 +42,26 @@ def load_base_query():
 
 base_sql_query = load_base_query()
 
+@st.cache_resource
+def load_benchmark_query():
+    """Slices the benchmark-only query (ending at the benchmark_baseline CTE) out of the base query."""
+    base_sql_query = load_base_query()
+    # Marker for the end of the benchmark_baseline CTE
+    benchmark_cte_end_marker = "ON benchmark_ids.employee_id = c.employee_id\n)"
+    benchmark_query_index = base_sql_query.index(benchmark_cte_end_marker) + len(benchmark_cte_end_marker)
+    return base_sql_query[:benchmark_query_index] + "\nSELECT * FROM benchmark_baseline;"
+
+benchmark_query_string = load_benchmark_query()
+
+SQL_CHUNKSIZE = 20000 # Rows fetched per round trip from the server-side cursor
+
+def read_query(query_string, query_params):
+    """Runs one parameterized query on its own pooled connection, streaming the rows in chunks."""
+    # stream_results uses a server-side cursor, so the full fan-out is never buffered in one fetch
+    with engine.connect().execution_options(stream_results=True) as connection:
+        chunks = pd.read_sql(text(query_string), connection, params=query_params, chunksize=SQL_CHUNKSIZE)
+        return pd.concat(chunks, ignore_index=True)
+
 # --- FETCH EMPLOYEE LIST ---
 @st.cache_data
 def get_employee_list():
@@ -69,70 +92,155 @@ def get_employee_list():
     # Handle potential NULLs in filter columns
     df['role'] = df['role'].fillna('Unknown')
     df['grade'] = df['grade'].fillna('Unknown')
+
+    # Low-cardinality filter columns as categoricals (the sidebar filters compare integer codes)
+    # and the 1-5 rating as float32 (NULL stays NaN)
+    df = df.astype({'role': 'category', 'grade': 'category', 'rating': 'float32'})
     
     return df
 
+@st.cache_data
+def get_employee_name_map():
+    """Maps each employee_id to its fullname, built once from the employee list."""
+    employee_list_df = get_employee_list()
+    return dict(zip(employee_list_df['employee_id'].values, employee_list_df['fullname'].values))
+
 
 
+# --- SHARED LLM EVENT LOOP ---
+LLM_MAX_CONCURRENCY = 5 # OpenRouter requests in flight at once across all sessions
+
+@st.cache_resource
+def get_llm_runtime():
+    """Starts one background event loop for async LLM calls, with a shared concurrency semaphore bound to it."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return loop, asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+@st.cache_resource
+def get_openrouter_client(api_key):
+    """Creates one async OpenRouter client per API key, reused (with its connection pool) across calls on the LLM loop."""
+    import openai
+    return openai.AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+
+async def astream_completion(client, llm_semaphore, messages, **params):
+    """Streams a chat completion from OpenRouter with the async client, yielding text chunks."""
+    async with llm_semaphore:
+        response = await client.chat.completions.create(messages=messages, stream=True, **params)
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+def iterate_on_llm_loop(async_chunks):
+    """Drives an async generator on the shared LLM loop and yields its items synchronously (for st.write_stream)."""
+    loop, _ = get_llm_runtime()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(async_chunks.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Release the semaphore slot even if the rerun stops the stream part-way
+        asyncio.run_coroutine_threadsafe(async_chunks.aclose(), loop)
+
+# --- PERSISTENT PROFILE CACHE ---
+# Finished profiles are stored on disk per (role, level, benchmark set, purpose), with the texts normalized
+# so edits to case or spacing reuse the stored profile; any other change generates a new one
+PROFILE_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '.cache', 'llm_hybrid')
+PROFILE_CACHE_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+AI_PROFILE_ERRORS = ("Error: Missing OpenRouter API key", "Failed to generate AI profile.")
+
+@st.cache_resource
+def get_profile_cache():
+    """Opens the on-disk cache of generated hybrid job profiles."""
+    return diskcache.Cache(PROFILE_CACHE_DIR)
+
+def normalize_prompt_text(value):
+    """Lowercases text and collapses whitespace so trivial edits compare equal."""
+    # Punctuation is kept: it can carry meaning ("C++" vs "C#", ".NET", "10%")
+    return " ".join(value.lower().split())
+
+def profile_cache_key(role_name, job_level, role_purpose, benchmark_ids):
+    """Builds the disk cache key for a hybrid job profile request."""
+    return (f"{normalize_prompt_text(role_name)}|{job_level}|{','.join(sorted(benchmark_ids))}"
+            f"|{normalize_prompt_text(role_purpose)}")
+
+def lookup_profile(role_name, job_level, role_purpose, benchmark_ids):
+    """Returns the stored profile for these inputs, or None."""
+    return get_profile_cache().get(profile_cache_key(role_name, job_level, role_purpose, benchmark_ids))
+
+def store_profile(role_name, job_level, role_purpose, benchmark_ids, profile):
+    """Stores a successfully generated profile in the disk cache."""
+    get_profile_cache().set(
+        profile_cache_key(role_name, job_level, role_purpose, benchmark_ids), profile, expire=PROFILE_CACHE_EXPIRE_SECONDS
+    )
+
+# --- BENCHMARK COMPETENCY LABELS ---
+# Competency fields evaluated as part of the benchmark analysis.
+COMPETENCY_FIELDS = (
+    'baseline_sea',
+    'baseline_qdd',
+    'baseline_ftc',
+    'baseline_ids',
+    'baseline_vcu',
+    'baseline_sto_lie',
+    'baseline_csi',
+    'baseline_cex_gdr'
+)
+
+# These are grouped competency pillars, representing combined behavioral strengths.
+GROUPED_COMPETENCY_LABELS = {
+    'CEX_GDR': 'Curiosity & Experimentation + Growth Drive & Resilience',
+    'STO_LIE': 'Synergy & Team Orientation + Lead, Inspire & Empower'
+}
+
+# This dictionary contains the standard names of each competency pillar.
+PILLAR_LABELS = {
+    'GDR': 'Growth Drive & Resilience',
+    'CEX': 'Curiosity & Experimentation',
+    'IDS': 'Insight & Decision Sharpness',
+    'QDD': 'Quality Delivery Discipline',
+    'STO': 'Synergy & Team Orientation',
+    'SEA': 'Social Empathy & Awareness',
+    'VCU': 'Value Creation for Users',
+    'LIE': 'Lead, Inspire & Empower',
+    'FTC': 'Forward Thinking & Clarity',
+    'CSI': 'Commercial Savvy & Impact'
+}
+
+# Resolved once: benchmark field -> competency code (e.g. 'STO_LIE') and -> display label
+FIELD_TO_CODE = {field: field.replace('baseline_', '').upper() for field in COMPETENCY_FIELDS}
+FIELD_TO_LABEL = {
+    field: GROUPED_COMPETENCY_LABELS.get(code, PILLAR_LABELS.get(code.split('_')[0], code))
+    for field, code in FIELD_TO_CODE.items()
+}
+
 # --- GENERATE AI JOB PROFILE (HYBRID V3) ---
-@st.cache_data
-def generate_job_profile(role_name, job_level, role_purpose, benchmark_profile: pd.Series):
-    """Generates a hybrid job profile using data (benchmark) and context (purpose)."""
+# A generator so the profile can be rendered with st.write_stream as the tokens arrive;
+# the finished text is kept in session state by the caller
+def stream_job_profile(role_name, job_level, role_purpose, benchmark_profile: pd.Series):
+    """Streams a hybrid job profile using data (benchmark) and context (purpose), yielding text chunks."""
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
-        return "Error: Missing OpenRouter API key. Please set it in your .env file."
+        yield "Error: Missing OpenRouter API key. Please set it in your .env file."
+        return
 
     # --- PART 1: THE DATA ---
     try:
-        # Competency fields evaluated as part of the benchmark analysis.
-        competency_fields = [
-            'baseline_sea',
-            'baseline_qdd',
-            'baseline_ftc',
-            'baseline_ids',
-            'baseline_vcu',
-            'baseline_sto_lie',
-            'baseline_csi',
-            'baseline_cex_gdr'
-        ]
-
-        # These are grouped competency pillars, representing combined behavioral strengths.
-        grouped_competency_labels = {
-            'CEX_GDR': 'Curiosity & Experimentation + Growth Drive & Resilience',
-            'STO_LIE': 'Synergy & Team Orientation + Lead, Inspire & Empower'
-        }
-
-        # This dictionary contains the standard names of each competency pillar.
-        pillar_labels = {
-            'GDR': 'Growth Drive & Resilience',
-            'CEX': 'Curiosity & Experimentation',
-            'IDS': 'Insight & Decision Sharpness',
-            'QDD': 'Quality Delivery Discipline',
-            'STO': 'Synergy & Team Orientation',
-            'SEA': 'Social Empathy & Awareness',
-            'VCU': 'Value Creation for Users',
-            'LIE': 'Lead, Inspire & Empower',
-            'FTC': 'Forward Thinking & Clarity',
-            'CSI': 'Commercial Savvy & Impact'
-        }
-
         # The system extracts only competencies that scored the maximum benchmark rating (5.0).
-        competencies_list = []
-        for field in competency_fields:
-            score = benchmark_profile[field]
-            if score == 5.0:
-                comp_code = field.replace('baseline_', '').upper()
-                comp_label = grouped_competency_labels.get(
-                    comp_code,
-                    pillar_labels.get(comp_code.split('_')[0], comp_code)
-                )
-                competencies_list.append(f"{comp_label} ({score:.1f}/5.0)")
+        competencies_list = [
+            f"{FIELD_TO_LABEL[field]} ({benchmark_profile[field]:.1f}/5.0)"
+            for field in COMPETENCY_FIELDS
+            if benchmark_profile[field] == 5.0
+        ]
 
         # If no competency scored 5.0, the system falls back to displaying all available benchmark competencies.
         if not competencies_list:
             competencies_list = [
-                f"{field.replace('baseline_', '').upper()} ({benchmark_profile[field]:.1f}/5.0)"
-                for field in competency_fields
+                f"{FIELD_TO_CODE[field]} ({benchmark_profile[field]:.1f}/5.0)"
+                for field in COMPETENCY_FIELDS
             ]
 
         competency_descriptions = "\n".join([f"- {c}" for c in competencies_list])
@@ -201,20 +309,110 @@ Using both **data from benchmark performers** and **business purpose**, your tas
 """
     
     try:
-        client = openai.OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
-        response = client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free", 
-            messages=[
+        # Stream through the cached async client on the shared loop (capped by its semaphore);
+        # the cached resources are resolved here, on the script thread
+        _, llm_semaphore = get_llm_runtime()
+        yield from iterate_on_llm_loop(astream_completion(
+            get_openrouter_client(api_key),
+            llm_semaphore,
+            [
                 {"role": "system", "content": "You are an expert HR strategist specializing in data-driven job profile creation."},
                 {"role": "user", "content": prompt}
             ],
+            model="meta-llama/llama-3.3-70b-instruct:free", 
             max_tokens=1400, 
-            temperature=0.6 
-        )
-        return response.choices[0].message.content.strip()
+            temperature=0.6
+        ))
     except Exception as e:
         st.error(f"Error generating AI profile: {e}")
-        return "Failed to generate AI profile."
+        yield "Failed to generate AI profile."
+
+# --- RUN BENCHMARK AND RANKING QUERIES ---
+# Cache per benchmark set for an hour (the HR data behind them changes rarely), keeping at most
+# 20 sets in memory since each entry holds a full employee x TGV x TV fan-out
+@st.cache_data(ttl=3600, max_entries=20, show_spinner=False)
+def run_queries(benchmark_ids: tuple[str, ...]):
+    """Runs the benchmark and full ranking queries for a (sorted) tuple of benchmark IDs; returns (results, 1-row profile, TGV averages, ranked candidates)."""
+    # 1. Bind the selected IDs to the ':benchmark_ids' text[] parameter of both queries
+    #    (the Benchmark-Only Query for the AI is sliced once at load time)
+    query_params = {"benchmark_ids": list(benchmark_ids)}
+
+    # 2. Execute the Benchmark and Full Ranking queries concurrently on separate connections
+    #    (the full query's output doesn't carry the baseline columns, so the benchmark query is needed too)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        benchmark_future = executor.submit(read_query, benchmark_query_string, query_params)
+        results_future = executor.submit(read_query, base_sql_query, query_params)
+        df_benchmark = benchmark_future.result()
+        df_sql_results = results_future.result()
+
+    # 3. Repeated text columns as categoricals, the benchmark flag as a plain bool mask
+    #    and the 0-100 match rates as float32 (half the bytes cached and kept in session state)
+    df_sql_results = df_sql_results.astype({
+        'role': 'category', 'grade': 'category', 'directorate': 'category',
+        'tgv_name': 'category', 'is_benchmark': 'bool',
+        'tv_match_rate': 'float32', 'tgv_match_rate': 'float32', 'final_match_rate': 'float32'
+    })
+
+    # 4. Build the TGV averages and the ranked list here, so they are cached in the same entry as the results
+    #    they come from and reruns from other widgets such as the candidate dropdown skip rebuilding them
+    df_tgv_agg = aggregate_tgv_rates(df_sql_results)
+    df_ranked_candidates = build_ranked_candidates(df_sql_results)
+    return df_sql_results, df_benchmark.iloc[0], df_tgv_agg, df_ranked_candidates # iloc[0]: the 1-row benchmark profile
+
+# --- BUILD DISPLAY FRAMES ---
+def aggregate_tgv_rates(df: pd.DataFrame) -> pd.DataFrame:
+    """Averages the TGV match rates over all employees ('all') and split by the benchmark flag ('benchmark' / 'candidate')."""
+    # One row per employee and TGV (the results repeat it for every TV)
+    tgv_scores = df[['employee_id', 'is_benchmark', 'tgv_name', 'tgv_match_rate']].drop_duplicates()
+    avg_all = tgv_scores.groupby('tgv_name', observed=True)['tgv_match_rate'].mean().reset_index()
+    avg_all['tgv_group'] = 'all'
+    avg_split = tgv_scores.groupby(['is_benchmark', 'tgv_name'], observed=True)['tgv_match_rate'].mean().reset_index()
+    avg_split['tgv_group'] = np.where(avg_split['is_benchmark'], 'benchmark', 'candidate')
+    return (
+        pd.concat([avg_all, avg_split], ignore_index=True)[['tgv_name', 'tgv_group', 'tgv_match_rate']]
+        .sort_values(['tgv_group', 'tgv_match_rate'], ignore_index=True)
+    )
+
+def build_ranked_candidates(df: pd.DataFrame) -> pd.DataFrame:
+    """Builds the ranked candidate list (with full names and top TGV) from the SQL results."""
+    # Row masks built once and reused below
+    is_bench = df['is_benchmark'].to_numpy(dtype=bool)
+    first_row = ~df['employee_id'].duplicated().to_numpy() # First row of each employee
+
+    # --- Calculate Top TGV (Domain) for each employee ---
+    df_top_tgv = pd.DataFrame() 
+    if not df.empty and 'tgv_match_rate' in df.columns and 'tgv_name' in df.columns and 'employee_id' in df.columns:
+        # Highest TGV per employee in one pass: stable sort (ties keep their original order), then first row per employee
+        df_top_tgv = (
+            df[['employee_id', 'tgv_name', 'tgv_match_rate']]
+            .dropna(subset=['tgv_match_rate'])
+            .sort_values('tgv_match_rate', ascending=False, kind='mergesort')
+            .drop_duplicates('employee_id')
+            .rename(columns={'tgv_name': 'top_tgv'})[['employee_id', 'top_tgv']]
+        )
+    else:
+        st.warning("Could not calculate Top TGV due to missing data in SQL results.")
+        df_top_tgv = pd.DataFrame(columns=['employee_id', 'top_tgv'])
+    # ----------------------------------------------------
+
+    # Create the base ranked DataFrame: one row per non-benchmark employee, in a single mask
+    df_ranked = df.loc[first_row & ~is_bench, ['employee_id', 'role', 'grade', 'directorate', 'final_match_rate']].copy()
+
+    # Look up 'fullname' by employee_id (dict lookup instead of a merge)
+    df_ranked['fullname'] = df_ranked['employee_id'].map(get_employee_name_map())
+
+    # --- Add the calculated Top TGV information ---
+    if not df_top_tgv.empty:
+        top_tgv_map = dict(zip(df_top_tgv['employee_id'], df_top_tgv['top_tgv']))
+        df_ranked['top_tgv'] = df_ranked['employee_id'].map(top_tgv_map).fillna('N/A')
+    else:
+        df_ranked['top_tgv'] = 'N/A'
+    # -------------------------------------------------
+
+    # Benchmarks are already filtered out above; rank the remaining candidates
+    df_ranked_candidates = df_ranked.sort_values('final_match_rate', ascending=False).reset_index(drop=True)
+    df_ranked_candidates.insert(0, 'Rank', range(1, len(df_ranked_candidates) + 1))
+    return df_ranked_candidates
 
 # --- MAIN STREAMLIT UI ---
 st.title("Talent Match Intelligence System 🧠✨")
@@ -263,15 +461,16 @@ with st.sidebar:
         index=0 
     )
 
-    # Filter the employee DataFrame based on ALL dropdown selections
-    filtered_df = employee_list_df.copy() 
+    # Filter the employee DataFrame based on ALL dropdown selections (one combined mask, indexed once)
+    mask = np.ones(len(employee_list_df), dtype=bool)
     if filter_role != "All":
-        filtered_df = filtered_df[filtered_df['role'] == filter_role]
+        mask &= np.asarray(employee_list_df['role'] == filter_role)
     if filter_grade != "All":
-        filtered_df = filtered_df[filtered_df['grade'] == filter_grade]
+        mask &= np.asarray(employee_list_df['grade'] == filter_grade)
     if filter_rating == '5': 
         # Correctly filters for 5.0 (float) using '5' (str)
-        filtered_df = filtered_df[filtered_df['rating'] == 5.0]
+        mask &= np.asarray(employee_list_df['rating'] == 5.0)
+    filtered_df = employee_list_df[mask]
 
     # --- Section 3: Select Benchmark Employees (Input for SQL) ---
     st.subheader("3. Select Benchmark Employees")
@@ -287,8 +486,9 @@ with st.sidebar:
         default=default_options 
     )
 
-    # Extract IDs from the selected display strings
-    selected_benchmark_ids = [display_str.split('(')[-1].replace(')', '') for display_str in selected_benchmarks]
+    # Map the selected display strings back to IDs (robust to names containing parentheses)
+    display_to_id = dict(zip(filtered_df['display'].values, filtered_df['employee_id'].values))
+    selected_benchmark_ids = [display_to_id[display_str] for display_str in selected_benchmarks]
 
     generate_button = st.button("✨ Generate Profile & Matches")
 
@@ -297,33 +497,16 @@ if generate_button:
     if not selected_benchmark_ids:
         st.sidebar.error("Please select at least one benchmark employee.")
     else:
-        # Create the SQL array string from the selected IDs
-        sql_array_string = "ARRAY[" + ",".join([f"'{eid}'" for eid in selected_benchmark_ids]) + "]::text[]"
-        
         try:
-            # 1. Define the marker to find the end of the benchmark_baseline CTE
-            benchmark_cte_end_marker = "ON benchmark_ids.employee_id = c.employee_id\n)"
-            
-            # Find the index to split the query
-            benchmark_query_index = base_sql_query.index(benchmark_cte_end_marker) + len(benchmark_cte_end_marker)
-            
-            # 2. Create the Benchmark-Only Query (to get data for the AI)
-            benchmark_query_string = base_sql_query[:benchmark_query_index] + "\nSELECT * FROM benchmark_baseline;"
-            
-            # 3. Parameterize both queries
-            parameterized_benchmark_query = benchmark_query_string.replace("ARRAY['EMP100012','EMP100524','EMP100548']::text[]", sql_array_string)
-            parameterized_full_query = base_sql_query.replace("ARRAY['EMP100012','EMP100524','EMP100548']::text[]", sql_array_string)
-
             with st.spinner("Analyzing talent data... ⏳"):
-                with engine.connect() as connection:
-                    # 4. Execute Benchmark Query First
-                    df_benchmark = pd.read_sql(text(parameterized_benchmark_query), connection)
-                    # 5. Execute Full Ranking Query
-                    df_sql_results = pd.read_sql(text(parameterized_full_query), connection)
+                # Sorted so the same benchmark set always hits the same cache entry
+                df_sql_results, benchmark_profile, df_tgv_agg, df_ranked_candidates = run_queries(tuple(sorted(selected_benchmark_ids)))
 
-                # 6. Store all results in session state
+                # Store all results in session state
                 st.session_state.sql_results = df_sql_results
-                st.session_state.benchmark_profile = df_benchmark.iloc[0] # Store the 1-row profile
+                st.session_state.benchmark_profile = benchmark_profile
+                st.session_state.tgv_agg = df_tgv_agg
+                st.session_state.ranked_candidates = df_ranked_candidates
                 
                 # --- ADD 'purpose' TO SESSION STATE ---
                 st.session_state.inputs = {
@@ -339,65 +522,58 @@ if generate_button:
             st.error(f"Database query failed: {e}")
             if 'sql_results' in st.session_state: del st.session_state.sql_results
             if 'benchmark_profile' in st.session_state: del st.session_state.benchmark_profile
+            if 'tgv_agg' in st.session_state: del st.session_state.tgv_agg
+            if 'ranked_candidates' in st.session_state: del st.session_state.ranked_candidates
 
 # --- DISPLAY RESULTS ---
 if 'sql_results' in st.session_state:
+    # Charting libraries are only needed once there are results to show
+    import plotly.express as px
+    import plotly.graph_objects as go
+
     # Retrieve all data from session state
     df = st.session_state.sql_results
     inputs = st.session_state.inputs
     benchmark_profile = st.session_state.benchmark_profile
-    
-    employee_list_df = get_employee_list() 
+    df_tgv_agg = st.session_state.tgv_agg # Per-TGV averages, aggregated once per benchmark set
+    df_ranked_candidates = st.session_state.ranked_candidates # Ranked candidate list, built with the results
+
+    # Employee ID array reused for the candidate subset below
+    emp_ids = df['employee_id'].to_numpy()
 
     try:
         # --- Display AI Generated Job Profile ---
         st.write("---") 
         st.subheader("🤖 Data-Driven Job Profile") 
         
-        # --- PASS 'purpose' TO THE AI FUNCTION ---
-        ai_profile = generate_job_profile(
-            inputs['role'], 
-            inputs['level'], 
-            inputs['purpose'], # <-- ADDED
-            benchmark_profile
-        )
-        st.markdown(ai_profile)
+        # Reuse the finished profile on reruns; only stream a new one when the inputs change
+        profile_key = (inputs['role'], inputs['level'], inputs['purpose'], tuple(sorted(inputs['benchmarks'])))
+        if st.session_state.get('ai_profile_key') == profile_key:
+            st.markdown(st.session_state.ai_profile)
+        else:
+            # Reuse a stored profile generated for the same (normalized) inputs before calling the LLM
+            ai_profile = lookup_profile(inputs['role'], inputs['level'], inputs['purpose'], inputs['benchmarks'])
+            if ai_profile is not None:
+                st.markdown(ai_profile)
+            else:
+                # --- PASS 'purpose' TO THE AI FUNCTION ---
+                ai_profile = st.write_stream(stream_job_profile(
+                    inputs['role'], 
+                    inputs['level'], 
+                    inputs['purpose'], # <-- ADDED
+                    benchmark_profile
+                ))
+                if not any(error in ai_profile for error in AI_PROFILE_ERRORS):
+                    store_profile(inputs['role'], inputs['level'], inputs['purpose'], inputs['benchmarks'], ai_profile)
+            # Only a successful profile is reused on reruns, so a failed one is retried (e.g. after a 429)
+            if not any(error in ai_profile for error in AI_PROFILE_ERRORS):
+                st.session_state.ai_profile = ai_profile
+                st.session_state.ai_profile_key = profile_key
 
         # --- Display Ranked Talent List ---
         st.write("---") 
         st.subheader("📊 Ranked Talent List")
 
-        # --- Calculate Top TGV (Domain) for each employee ---
-        df_top_tgv = pd.DataFrame() 
-        if not df.empty and 'tgv_match_rate' in df.columns and 'tgv_name' in df.columns and 'employee_id' in df.columns:
-            df_unique_tgv = df[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates()
-            idx = df_unique_tgv.loc[df_unique_tgv.groupby('employee_id')['tgv_match_rate'].idxmax()]
-            df_top_tgv = idx[['employee_id', 'tgv_name']].copy()
-            df_top_tgv.rename(columns={'tgv_name': 'top_tgv'}, inplace=True)
-        else:
-            st.warning("Could not calculate Top TGV due to missing data in SQL results.")
-            df_top_tgv = pd.DataFrame(columns=['employee_id', 'top_tgv'])
-        # ----------------------------------------------------
-
-        # Create the base ranked DataFrame
-        df_ranked = df[['employee_id', 'role', 'grade', 'directorate', 'final_match_rate', 'is_benchmark']].drop_duplicates('employee_id').copy()
-        
-        # Merge with the full employee list to get 'fullname'
-        df_ranked = pd.merge(df_ranked, employee_list_df[['employee_id', 'fullname']], on='employee_id', how='left')
-
-        # --- Merge the calculated Top TGV information ---
-        if not df_top_tgv.empty:
-            df_ranked = pd.merge(df_ranked, df_top_tgv, on='employee_id', how='left')
-            df_ranked['top_tgv'] = df_ranked['top_tgv'].fillna('N/A')
-        else:
-            df_ranked['top_tgv'] = 'N/A'
-        # -------------------------------------------------
-
-        # Filter out benchmarks for the final ranked list
-        df_ranked_candidates = df_ranked[df_ranked['is_benchmark'] == False].copy()
-        df_ranked_candidates = df_ranked_candidates.sort_values('final_match_rate', ascending=False).reset_index(drop=True)
-        df_ranked_candidates.insert(0, 'Rank', range(1, len(df_ranked_candidates) + 1))
-
         # Display the ranked list
         st.dataframe(
             df_ranked_candidates[['Rank', 'employee_id', 'fullname', 'role', 'grade', 'directorate', 'top_tgv', 'final_match_rate']],
@@ -423,9 +599,11 @@ if 'sql_results' in st.session_state:
         with col1:
             st.markdown("**Final Match Rate Distribution (Candidates)**")
             if not df_ranked_candidates.empty:
-                fig_hist = px.histogram(df_ranked_candidates, x="final_match_rate", nbins=20,
-                                        labels={'final_match_rate': 'Final Match Rate (%)'})
-                fig_hist.update_layout(yaxis_title="Number of Candidates", bargap=0.1, xaxis_range=[0,100])
+                # Bin in numpy (20 bins of 5% over 0-100) so the browser only receives the bin counts
+                match_rates = df_ranked_candidates['final_match_rate'].to_numpy(dtype=float)
+                counts, edges = np.histogram(match_rates[~np.isnan(match_rates)], bins=20, range=(0, 100))
+                fig_hist = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=4.5))
+                fig_hist.update_layout(xaxis_title="Final Match Rate (%)", yaxis_title="Number of Candidates", xaxis_range=[0,100])
                 st.plotly_chart(fig_hist, use_container_width=True) # As requested
             else:
                 st.warning("No candidate data available for histogram.")
@@ -433,10 +611,9 @@ if 'sql_results' in st.session_state:
         # Bar Chart of Average TGV Match Rate
         with col2:
             st.markdown("**Average Match Rate per TGV (All Employees)**")
-            if not df.empty and 'tgv_match_rate' in df.columns:
-                df_tgv_unique = df[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates()
-                avg_tgv = df_tgv_unique.groupby('tgv_name')['tgv_match_rate'].mean().reset_index()
-                avg_tgv = avg_tgv.sort_values('tgv_match_rate', ascending=True)  
+            # Already sorted ascending
+            avg_tgv = df_tgv_agg[df_tgv_agg['tgv_group'] == 'all']
+            if not avg_tgv.empty:
                 fig_tgv = px.bar(avg_tgv, x='tgv_match_rate', y='tgv_name', orientation='h',
                                text_auto='.1f', 
                                labels={'tgv_match_rate': 'Average Match Rate (%)', 'tgv_name': 'Talent Group Variable'})
@@ -455,13 +632,12 @@ if 'sql_results' in st.session_state:
             selected_candidate_display = st.selectbox("Select Candidate:", options=candidate_options)
             selected_candidate_id = selected_candidate_display.split(" - ")[0]
 
-            # Filter data for the selected candidate and benchmarks
-            benchmark_data = df[df['is_benchmark']]
-            candidate_data = df[df['employee_id'] == selected_candidate_id]
+            # Filter data for the selected candidate
+            candidate_data = df[emp_ids == selected_candidate_id]
 
-            # Calculate average TGV scores for both groups
-            bench_tgv_avg = benchmark_data[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates().groupby('tgv_name')['tgv_match_rate'].mean()
-            cand_tgv_avg = candidate_data[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates().groupby('tgv_name')['tgv_match_rate'].mean()
+            # Benchmark TGV averages are pre-aggregated; only the one candidate is averaged here
+            bench_tgv_avg = df_tgv_agg[df_tgv_agg['tgv_group'] == 'benchmark'].set_index('tgv_name')['tgv_match_rate']
+            cand_tgv_avg = candidate_data[['employee_id', 'tgv_name', 'tgv_match_rate']].drop_duplicates().groupby('tgv_name', observed=True)['tgv_match_rate'].mean()
 
             # Define the axes for the radar chart
             default_tgvs = [
@@ -501,19 +677,21 @@ if 'sql_results' in st.session_state:
 
             # --- Display Summary Insights ---
             st.markdown("**Summary Insights:**")
-            diffs = radar_df['Candidate'] - radar_df['Benchmark Avg']
-            if diffs.notna().any():
-                idx_max_diff = diffs.idxmax()
-                idx_min_diff = diffs.idxmin()
+            cand_scores = radar_df['Candidate'].to_numpy(dtype=float)
+            bench_scores = radar_df['Benchmark Avg'].to_numpy(dtype=float)
+            diffs = cand_scores - bench_scores
+            if not np.isnan(diffs).all():
+                i_max = int(np.nanargmax(diffs))
+                i_min = int(np.nanargmin(diffs))
                 # Strongest Area
                 st.success(
-                    f"**Candidate's Strongest Area (vs Benchmark):** {radar_df.loc[idx_max_diff, 'tgv_name']} "
-                    f"({radar_df.loc[idx_max_diff, 'Candidate']:.1f}% vs {radar_df.loc[idx_max_diff, 'Benchmark Avg']:.1f}%)"
+                    f"**Candidate's Strongest Area (vs Benchmark):** {default_tgvs[i_max]} "
+                    f"({cand_scores[i_max]:.1f}% vs {bench_scores[i_max]:.1f}%)"
                 )
                 # Largest Gap
                 st.warning(
-                    f"**Candidate's Largest Gap (vs Benchmark):** {radar_df.loc[idx_min_diff, 'tgv_name']} "
-                    f"({radar_df.loc[idx_min_diff, 'Candidate']:.1f}% vs {radar_df.loc[idx_min_diff, 'Benchmark Avg']:.1f}%)"
+                    f"**Candidate's Largest Gap (vs Benchmark):** {default_tgvs[i_min]} "
+                    f"({cand_scores[i_min]:.1f}% vs {bench_scores[i_min]:.1f}%)"
                 )
             else:
                 st.info("Could not determine detailed comparison insights.")
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import diskcache
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+# --- SHARED AI JOB PROFILE SETTINGS ---
+# Used by both the Streamlit app (app.py) and the offline pre-generation script (prebake_profiles.py),
+# so pre-generated profiles land under exactly the cache keys the app looks up and follow the same request policy.
+
+# Model and generation parameters for the OpenRouter API
+LLM_BASE_URL = "https://openrouter.ai/api/v1"
+LLM_MODEL = "meta-llama/llama-3.3-70b-instruct:free" # Using a capable free model
+LLM_SYSTEM_PROMPT = "You are an expert HR assistant specializing in job profile creation."
+LLM_MAX_TOKENS = 400 # Limit the response length
+LLM_TEMPERATURE = 0.6 # Control the creativity of the response
+
+# Caps on OpenRouter traffic (shared by every session of the app, or by one prebake run)
+LLM_MAX_CONCURRENCY = 4 # Requests in flight at once
+LLM_REQUESTS_PER_MINUTE = 20 # OpenRouter's request limit for free models
+
+# Job levels offered in the app's sidebar
+JOB_LEVELS = ["Staff", "Supervisor", "Manager", "Senior Manager"]
+
+# Generated profiles are persisted on disk and expire after a week
+LLM_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '.cache', 'llm')
+LLM_CACHE_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+
+def build_job_profile_prompt(role_name, job_level, role_purpose):
+    """Builds the user prompt asking the AI model for a job profile."""
+    return f"""
+    Generate a concise job profile for the following role:
+    Role: {role_name}
+    Level: {job_level}
+    Purpose: {role_purpose}
+
+    Structure the output using markdown with these sections:
+    ## Job Requirements
+    - Provide 5 to 7 key requirements as bullet points.
+    ## Job Description
+    - Write a brief paragraph summarizing the role's responsibilities.
+    ## Key Competencies
+    - List 5 essential competencies as bullet points.
+    """
+
+def build_job_profile_messages(role_name, job_level, role_purpose):
+    """Builds the chat messages sent to the AI model for a job profile."""
+    return [
+        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+        {"role": "user", "content": build_job_profile_prompt(role_name, job_level, role_purpose)}
+    ]
+
+def job_profile_cache_key(role_name, job_level, role_purpose):
+    """Builds the disk cache key for a job profile request."""
+    return hashlib.sha256(f"{role_name}|{job_level}|{role_purpose}".encode()).digest()
+
+def open_llm_disk_cache():
+    """Opens the on-disk cache of generated job profiles, which survives app restarts."""
+    return diskcache.Cache(LLM_CACHE_DIR)
+
+# Exponential backoff (with jitter) used when OpenRouter doesn't tell us how long to wait
+backoff_wait = wait_exponential_jitter(initial=1, max=30)
+
+def wait_retry_after(retry_state):
+    """Waits for the 'retry-after' seconds sent with a 429 response, falling back to exponential backoff."""
+    error = retry_state.outcome.exception()
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return min(float(retry_after), 30)
+    except (TypeError, ValueError):
+        return backoff_wait(retry_state)
+
+# Retry transient OpenRouter failures (rate limits and server errors) instead of surfacing them;
+# clients passed in should be created with max_retries=0 so this is the only retry policy
+@retry(
+    wait=wait_retry_after,
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.InternalServerError)),
+    reraise=True
+)
+async def request_job_profile(client, llm_semaphore, llm_limiter, messages):
+    """Sends the job profile messages to the AI model and returns the raw completion."""
+    # Wait for a free slot and for the per-minute budget so bursts are smoothed out instead of hitting 429s
+    async with llm_semaphore, llm_limiter:
+        return await client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            max_tokens=LLM_MAX_TOKENS,
+            temperature=LLM_TEMPERATURE
+        )
@@ -0,0 +1,73 @@
+import os
+import asyncio
+import itertools
+from dotenv import load_dotenv
+import openai
+from aiolimiter import AsyncLimiter
+from job_profile_llm import (
+    LLM_BASE_URL, LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_CACHE_EXPIRE_SECONDS, JOB_LEVELS,
+    build_job_profile_messages, job_profile_cache_key, open_llm_disk_cache, request_job_profile
+)
+
+# --- OFFLINE JOB PROFILE PRE-GENERATION ---
+# Generates AI job profiles for common role / level / purpose combinations ahead of time
+# and stores them in the app's disk cache, so those requests are instant in the app.
+# Usage: python 3_app/prebake_profiles.py
+
+# Roles and role purposes to pre-generate (every combination with every job level)
+COMMON_ROLES = [
+    "Data Analyst",
+    "Sales Supervisor",
+    "HR Business Partner",
+    "Internal Auditor",
+    "Marketing Specialist",
+]
+COMMON_PURPOSES = [
+    # Default purpose shown in the app's sidebar
+    "Analyze complex datasets to extract meaningful insights and support data-driven decision-making across the organization.",
+    "Drive team performance and revenue growth by coaching staff and improving operational processes.",
+]
+
+async def prebake_profile(client, disk_cache, semaphore, limiter, role_name, job_level, role_purpose):
+    """Generates one job profile and stores it under the same cache key the app uses."""
+    # Same request, limits and 429 retry policy as the app
+    response = await request_job_profile(
+        client, semaphore, limiter, build_job_profile_messages(role_name, job_level, role_purpose)
+    )
+    profile = response.choices[0].message.content.strip()
+    disk_cache.set(job_profile_cache_key(role_name, job_level, role_purpose), profile, expire=LLM_CACHE_EXPIRE_SECONDS)
+
+async def main():
+    """Pre-generates every missing role / level / purpose combination."""
+    dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+    load_dotenv(dotenv_path=dotenv_path)
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise SystemExit("Error: Missing OpenRouter API key. Please set it in your .env file.")
+
+    disk_cache = open_llm_disk_cache()
+    # Skip combinations that are already cached
+    combinations = [
+        combo for combo in itertools.product(COMMON_ROLES, JOB_LEVELS, COMMON_PURPOSES)
+        if job_profile_cache_key(*combo) not in disk_cache
+    ]
+    print(f"Pre-generating {len(combinations)} job profiles...")
+
+    # Retries (honoring OpenRouter's retry-after header on 429s) are handled by request_job_profile
+    client = openai.AsyncOpenAI(base_url=LLM_BASE_URL, api_key=api_key, max_retries=0)
+    # Stay within OpenRouter's free-model limits while running unattended
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    limiter = AsyncLimiter(LLM_REQUESTS_PER_MINUTE, 60)
+    results = await asyncio.gather(
+        *(prebake_profile(client, disk_cache, semaphore, limiter, *combo) for combo in combinations),
+        return_exceptions=True
+    )
+
+    # Report failures without aborting the whole run
+    failures = [(combo, result) for combo, result in zip(combinations, results) if isinstance(result, Exception)]
+    for combo, error in failures:
+        print(f"Failed {combo}: {error}")
+    print(f"Done: {len(combinations) - len(failures)} stored, {len(failures)} failed.")
+
+if __name__ == "__main__":
+    asyncio.run(main())